@@ -7,14 +7,32 @@ YouTube video URL or video ID.
 from __future__ import annotations
 
 import re
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional
 
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from backend.cache import LRUCache
+
 #API key
 API_KEY: str = "YOUR_API_KEY_HERE"
 
+# Raw 11-character video ID, and the URL forms it can appear in:
+# watch?v=, youtu.be/, /shorts/, /live/, /embed/, /v/, /videos/
+_ID_RE = re.compile(r"[0-9A-Za-z_-]{11}")
+_URL_ID_RE = re.compile(r"(?:v=|youtu\.be/|/shorts/|/live/|/embed/|/v/|/videos/)([0-9A-Za-z_-]{11})")
+
+# Partial response: only the snippet fields we keep, which shrinks each page considerably
+_COMMENT_FIELDS: str = (
+    "nextPageToken,"
+    "items(id,snippet/topLevelComment/snippet(authorDisplayName,publishedAt,likeCount,textOriginal,textDisplay))"
+)
+
+# Recently fetched pages keyed by (video_id, max_comments). The same video is often
+# re-analyzed (other method, CSV download), so re-use the pages for a while.
+_comments_cache: "LRUCache[List[List[Dict]]]" = LRUCache(maxsize=32, ttl=600.0)
+
 
 def extract_video_id(url_or_id: str) -> Optional[str]:
     """
@@ -35,28 +53,17 @@ def extract_video_id(url_or_id: str) -> Optional[str]:
     candidate = url_or_id.strip()
 
     # If the user pasted a raw ID (11 chars, valid charset), accept it directly.
-    if re.fullmatch(r"[0-9A-Za-z_-]{11}", candidate):
+    if _ID_RE.fullmatch(candidate):
         return candidate
 
-    patterns = [
-        r"(?:v=)([0-9A-Za-z_-]{11})",           # watch?v=VIDEOID
-        r"youtu\.be/([0-9A-Za-z_-]{11})",      # youtu.be/VIDEOID
-        r"/shorts/([0-9A-Za-z_-]{11})",         # /shorts/VIDEOID
-        r"/live/([0-9A-Za-z_-]{11})",           # /live/VIDEOID
-        r"/embed/([0-9A-Za-z_-]{11})",          # /embed/VIDEOID
-        r"/v/([0-9A-Za-z_-]{11})",              # /v/VIDEOID
-        r"/videos/([0-9A-Za-z_-]{11})",         # /videos/VIDEOID
-    ]
-
-    for pat in patterns:
-        m = re.search(pat, candidate)
-        if m:
-            return m.group(1)
-
-    m = re.search(r"([0-9A-Za-z_-]{11})", candidate)
+    m = _URL_ID_RE.search(candidate)
     if m:
         return m.group(1)
 
+    m = _ID_RE.search(candidate)
+    if m:
+        return m.group(0)
+
     return None
 
 
@@ -65,46 +72,74 @@ def _get_youtube_service():
     return build("youtube", "v3", developerKey=API_KEY)
 
 
-def fetch_comments(url_or_id: str, max_comments: int = 200) -> List[Dict]:
+def iter_comment_pages(url_or_id: str, max_comments: int = 200) -> Iterator[List[Dict]]:
     """
-    Fetch up to max_comments of the latest top-level comments for the given YouTube video.
+    Yield the latest top-level comments for the given YouTube video one API page at a time.
 
-    Args:
-        url_or_id: A full YouTube URL or raw video ID.
-        max_comments: Maximum number of comments to fetch (API returns up to 100 per page).
+    The next page is requested on a background thread as soon as its token is known, so
+    the caller can process one page while the following one is still in flight. Stops
+    after max_comments comments in total. On an API error, a final page holding a single
+    error-marker entry is yielded.
 
-    Returns:
-        A list of dictionaries with keys: comment_id, author, published_at, like_count, text.
+    Complete, error-free fetches are cached for a few minutes per (video ID, max_comments).
+
+    Yields:
+        Lists of dictionaries with keys: comment_id, author, published_at, like_count, text, video_id.
     """
     video_id = extract_video_id(url_or_id)
     if not video_id:
         raise ValueError("Could not extract a valid YouTube video ID from the provided input.")
 
-    comments: List[Dict] = []
+    cache_key = (video_id, max_comments)
+    cached = _comments_cache.get(cache_key)
+    if cached is not None:
+        yield from cached
+        return
+
     service = _get_youtube_service()
 
-    page_token: Optional[str] = None
+    def _request_page(page_token: Optional[str]) -> Dict:
+        req = service.commentThreads().list(
+            part="snippet",
+            videoId=video_id,
+            maxResults=100,
+            textFormat="plainText",
+            order="time",
+            pageToken=page_token,
+            fields=_COMMENT_FIELDS,
+        )
+        return req.execute()
+
+    pages: List[List[Dict]] = []
     fetched = 0
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        pending = pool.submit(_request_page, None)
+        while pending is not None:
+            try:
+                resp = pending.result()
+            except HttpError as e:
+                # Stop with an error marker; pages already yielded are kept by the caller
+                yield [
+                    {
+                        "comment_id": None,
+                        "author": None,
+                        "published_at": None,
+                        "like_count": None,
+                        "text": f"YouTube API error: {e}",
+                        "video_id": video_id,
+                    }
+                ]
+                return
 
-    try:
-        while True:
-            req = service.commentThreads().list(
-                part="snippet",
-                videoId=video_id,
-                maxResults=100,
-                textFormat="plainText",
-                order="time",
-                pageToken=page_token,
-            )
-            resp = req.execute()
-
-            items = resp.get("items", [])
-            for it in items:
+            page: List[Dict] = []
+            for it in resp.get("items", []):
+                if fetched >= max_comments:
+                    break
                 snip = it.get("snippet", {})
                 top = snip.get("topLevelComment", {}).get("snippet", {})
                 if not top:
                     continue
-                comments.append(
+                page.append(
                     {
                         "comment_id": it.get("id"),
                         "author": top.get("authorDisplayName"),
@@ -116,27 +151,30 @@ def fetch_comments(url_or_id: str, max_comments: int = 200) -> List[Dict]:
                     }
                 )
                 fetched += 1
-                if fetched >= max_comments:
-                    break
-
-            if fetched >= max_comments:
-                break
 
+            # Prefetch the next page before handing this one to the caller
             page_token = resp.get("nextPageToken")
-            if not page_token:
-                break
-
-    except HttpError as e:
-        # Return what we have and attach an error marker as a final entry 
-        comments.append(
-            {
-                "comment_id": None,
-                "author": None,
-                "published_at": None,
-                "like_count": None,
-                "text": f"YouTube API error: {e}",
-                "video_id": video_id,
-            }
-        )
+            pending = pool.submit(_request_page, page_token) if page_token and fetched < max_comments else None
 
+            if page:
+                pages.append(page)
+                yield page
+
+    _comments_cache.put(cache_key, pages)
+
+
+def fetch_comments(url_or_id: str, max_comments: int = 200) -> List[Dict]:
+    """
+    Fetch up to max_comments of the latest top-level comments for the given YouTube video.
+
+    Args:
+        url_or_id: A full YouTube URL or raw video ID.
+        max_comments: Maximum number of comments to fetch (API returns up to 100 per page).
+
+    Returns:
+        A list of dictionaries with keys: comment_id, author, published_at, like_count, text.
+    """
+    comments: List[Dict] = []
+    for page in iter_comment_pages(url_or_id, max_comments=max_comments):
+        comments.extend(page)
     return comments
@@ -1,14 +1,20 @@
 """
 Multilingual text cleaning and sentiment analysis utilities.
 
-Adds language detection (langdetect), translation to English (googletrans),
+Adds language detection (langdetect), translation to English (googletrans, or
+batched through Google Cloud Translation v3 when it is installed and configured),
 and emoji-aware preprocessing. Performs sentiment using VADER or TextBlob on
 English text (translated when necessary). Also prepares text for wordclouds.
 """
 from __future__ import annotations
 
+import functools
+import hashlib
+import os
+import random
 import re
-from typing import Dict, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
@@ -17,12 +23,28 @@ from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from langdetect import detect, DetectorFactory
 from googletrans import Translator
 
+from backend.cache import LRUCache
+
+try:
+    from google.cloud import translate_v3
+except ImportError:  # optional: only needed for batch translation through Cloud Translation
+    translate_v3 = None
+
 # Make langdetect deterministic
 DetectorFactory.seed = 0
 
 _vader = SentimentIntensityAnalyzer()
 _translator = Translator()
 
+# Google Cloud project for the official Translation API (v3). When set and
+# google-cloud-translate is installed, translate_many sends whole batches in one
+# request instead of one googletrans call per comment.
+GOOGLE_CLOUD_PROJECT: str = os.environ.get("GOOGLE_CLOUD_PROJECT", "")
+# API limits per translate_text request: 1024 strings, ~30k code points recommended
+_CLOUD_BATCH_MAX_TEXTS = 1024
+_CLOUD_BATCH_MAX_CHARS = 30000
+_cloud_client = None
+
 # Simple emoji sentiment hints to influence VADER/TextBlob
 _EMOJI_SENTIMENT_MAP = {
     "😀": " positive ", "😃": " positive ", "😄": " positive ", "😁": " positive ",
@@ -33,58 +55,88 @@ _EMOJI_SENTIMENT_MAP = {
     "😐": " neutral ",  "😑": " neutral ",  "😶": " neutral ",
 }
 
+# URLs and @mentions/#hashtags, stripped by both cleaners in a single pass
+_URL_HANDLE_PATTERN = r"https?://\S+|www\.\S+|[@#]\w+"
+_URL_HANDLE_RE = re.compile(_URL_HANDLE_PATTERN)
+# Same, plus anything that is not a lowercase alphanumeric or whitespace (wordcloud text)
+_CLEAN_RE = re.compile(_URL_HANDLE_PATTERN + r"|[^a-z0-9\s]")
+
+# Longest keys first so multi-codepoint emoji (e.g. "❤️") win over their prefixes
+_EMOJI_RE = re.compile(
+    "|".join(re.escape(k) for k in sorted(_EMOJI_SENTIMENT_MAP, key=len, reverse=True))
+)
+
+# vaderSentiment >= 3.3.1 can take orders of magnitude longer on text with many
+# emoji, so anything non-ASCII left after emoji replacement is dropped before
+# scoring, and very long comments are truncated.
+_NON_ASCII_RE = re.compile(r"[^\x00-\x7f]")
+_MAX_SENTIMENT_CHARS = 2000
+
+# Compound/polarity score cut-offs for Positive / Negative (Neutral in between)
+_POSITIVE_THRESHOLD = 0.05
+_NEGATIVE_THRESHOLD = -0.05
+
+# Upper bound on concurrent translation requests; each one is a network round-trip
+_TRANSLATE_WORKERS = 20
+
+# langdetect cost grows with input length while its answer settles long before that
+_MAX_DETECT_CHARS = 500
+
+# Comment threads repeat themselves a lot (copy-paste, "first!", spam), so successful
+# translations are kept in an in-process LRU keyed by (src_lang, text digest).
+_TRANSLATION_CACHE_SIZE = 10000
+_translation_cache: "LRUCache[str]" = LRUCache(maxsize=_TRANSLATION_CACHE_SIZE)
+
 
 def _replace_emojis(text: str) -> str:
     if not isinstance(text, str):
         return ""
-    out = []
-    for ch in text:
-        out.append(_EMOJI_SENTIMENT_MAP.get(ch, ch))
-    return "".join(out)
+    return _EMOJI_RE.sub(lambda m: _EMOJI_SENTIMENT_MAP[m.group(0)], text)
 
 
 def clean_text(text: str) -> str:
     """Conservative cleaning for wordclouds: lowercase, remove URLs/handles, strip non-alphanum except spaces."""
     if not isinstance(text, str):
         return ""
-    s = text.lower()
-    # Remove URLs
-    s = re.sub(r"https?://\S+|www\.\S+", " ", s)
-    # Remove mentions/hashtags
-    s = re.sub(r"[@#]\w+", " ", s)
-    # Remove non-alphanumeric (keep spaces)
-    s = re.sub(r"[^a-z0-9\s]", " ", s)
-    # Collapse multiple spaces
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    # Remove URLs, mentions/hashtags and non-alphanumerics (keep spaces) in one pass
+    s = _CLEAN_RE.sub(" ", text.lower())
+    # Collapse whitespace
+    return " ".join(s.split())
 
 
 def prepare_for_sentiment(text: str) -> str:
-    """Preprocessing for sentiment: keep punctuation and emojis, remove URLs and handles."""
+    """Preprocessing for sentiment: keep punctuation and emoji hints, remove URLs, handles and other non-ASCII."""
     if not isinstance(text, str):
         return ""
-    s = text.lower()
-    # Remove URLs and common artifacts
-    s = re.sub(r"https?://\S+|www\.\S+", " ", s)
-    s = re.sub(r"[@#]\w+", " ", s)
+    # Remove URLs and handles
+    s = _URL_HANDLE_RE.sub(" ", text.lower())
     # Replace emojis with sentiment hints (keeps the emoji effect)
     s = _replace_emojis(s)
-    # Remove control characters
-    s = re.sub(r"[\r\n\t]", " ", s)
-    # Collapse whitespace
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+    # Drop residual non-ASCII (unmapped emoji etc.) that VADER would otherwise iterate
+    s = _NON_ASCII_RE.sub(" ", s)
+    # Collapse whitespace, including control characters like \r\n\t
+    return " ".join(s.split())[:_MAX_SENTIMENT_CHARS]
 
 
 def label_from_compound(score: float) -> str:
     """Map VADER/TextBlob-like compound score to Positive/Neutral/Negative."""
-    if score >= 0.05:
+    if score >= _POSITIVE_THRESHOLD:
         return "Positive"
-    if score <= -0.05:
+    if score <= _NEGATIVE_THRESHOLD:
         return "Negative"
     return "Neutral"
 
 
+def labels_from_compound(scores: np.ndarray) -> np.ndarray:
+    """Vectorized label_from_compound: map a whole array of scores to labels in one NumPy pass."""
+    return np.select(
+        [scores >= _POSITIVE_THRESHOLD, scores <= _NEGATIVE_THRESHOLD],
+        ["Positive", "Negative"],
+        default="Neutral",
+    )
+
+
+@functools.lru_cache(maxsize=_TRANSLATION_CACHE_SIZE)
 def detect_language(text: str) -> str:
     """Detect language using langdetect; returns ISO 639-1 code like 'en', or 'und' if unknown."""
     try:
@@ -94,17 +146,126 @@ def detect_language(text: str) -> str:
         return "und"
 
 
+def detect_languages(texts: List[str]) -> List[str]:
+    """Detect languages for a batch of texts, running langdetect once per distinct (truncated) text."""
+    langs = {
+        t: detect_language(t[:_MAX_DETECT_CHARS]) if isinstance(t, str) else "und"
+        for t in dict.fromkeys(texts)
+    }
+    return [langs[t] for t in texts]
+
+
+def _translation_key(text: str, src_lang: str) -> Tuple[str, bytes]:
+    return src_lang.lower(), hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
 def translate_to_english(text: str, src_lang: str) -> Tuple[str, bool]:
     """Translate to English using googletrans; returns (translated_text, had_error)."""
     if not isinstance(text, str) or not text.strip():
         return "", False
     if src_lang.lower() in ("en", "und"):
         return text, False
+    key = _translation_key(text, src_lang)
+    cached = _translation_cache.get(key)
+    if cached is not None:
+        return cached, False
     try:
         res = _translator.translate(text, src=src_lang, dest="en")
-        return res.text, False
     except Exception:
+        # Failures are not cached so the next request retries them
         return text, True
+    _translation_cache.put(key, res.text)
+    return res.text, False
+
+
+def _get_cloud_client():
+    global _cloud_client
+    if _cloud_client is None:
+        _cloud_client = translate_v3.TranslationServiceClient()
+    return _cloud_client
+
+
+def _cloud_batches(keys: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+    """Split (lang, text) keys into translate_text-sized batches (by string count and total length)."""
+    batches: List[List[Tuple[str, str]]] = []
+    current: List[Tuple[str, str]] = []
+    chars = 0
+    for key in keys:
+        n = len(key[1])
+        if current and (len(current) >= _CLOUD_BATCH_MAX_TEXTS or chars + n > _CLOUD_BATCH_MAX_CHARS):
+            batches.append(current)
+            current, chars = [], 0
+        current.append(key)
+        chars += n
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _translate_cloud_batch(keys: List[Tuple[str, str]]) -> Dict[Tuple[str, str], Tuple[str, bool]]:
+    """Translate distinct (lang, text) keys with Cloud Translation v3, using the cache and one request per batch."""
+    out: Dict[Tuple[str, str], Tuple[str, bool]] = {}
+    uncached: List[Tuple[str, str]] = []
+    for key in keys:
+        hit = _translation_cache.get(_translation_key(key[1], key[0]))
+        if hit is not None:
+            out[key] = (hit, False)
+        else:
+            uncached.append(key)
+
+    parent = f"projects/{GOOGLE_CLOUD_PROJECT}/locations/global"
+    for batch in _cloud_batches(uncached):
+        try:
+            # No source language: the API detects it per string, which beats langdetect on short comments
+            resp = _get_cloud_client().translate_text(
+                request={
+                    "parent": parent,
+                    "contents": [text for _, text in batch],
+                    "mime_type": "text/plain",
+                    "target_language_code": "en",
+                }
+            )
+        except Exception:
+            out.update((key, (key[1], True)) for key in batch)
+            continue
+        for key, tr in zip(batch, resp.translations):
+            _translation_cache.put(_translation_key(key[1], key[0]), tr.translated_text)
+            out[key] = (tr.translated_text, False)
+    return out
+
+
+def translate_many(texts: List[str], langs: List[str]) -> List[Tuple[str, bool]]:
+    """
+    Translate texts to English; returns one (translated_text, had_error) per input, like translate_to_english.
+
+    Uses batched Cloud Translation v3 requests when configured, otherwise concurrent googletrans calls.
+    """
+    results: List[Tuple[str, bool]] = [
+        (t, False) if isinstance(t, str) and t.strip() else ("", False) for t in texts
+    ]
+    # Only non-English, non-empty texts need a network round-trip
+    pending = [
+        i for i, lang in enumerate(langs)
+        if results[i][0] and str(lang).lower() not in ("en", "und")
+    ]
+    if not pending:
+        return results
+
+    # Translate each distinct (lang, text) once and fan the result back out to its duplicates
+    groups: Dict[Tuple[str, str], List[int]] = {}
+    for i in pending:
+        groups.setdefault((str(langs[i]), texts[i]), []).append(i)
+
+    if translate_v3 is not None and GOOGLE_CLOUD_PROJECT:
+        translated = _translate_cloud_batch(list(groups))
+    else:
+        with ThreadPoolExecutor(max_workers=min(_TRANSLATE_WORKERS, len(groups))) as pool:
+            translated = dict(zip(groups, pool.map(lambda key: translate_to_english(key[1], key[0]), groups)))
+
+    for key, indices in groups.items():
+        for i in indices:
+            results[i] = translated[key]
+    return results
 
 
 def analyze_sentiment_text(text_en: str, method: str = "vader") -> Tuple[float, str]:
@@ -126,6 +287,26 @@ def analyze_sentiment_text(text_en: str, method: str = "vader") -> Tuple[float,
         return c, label_from_compound(c)
 
 
+def sample_comments(
+    comments: List[Dict], k: int, top_liked_share: float = 0.25, seed: Optional[Union[int, str]] = None
+) -> List[Dict]:
+    """
+    Keep at most k comments: the most-liked ones (top_liked_share of k) plus a uniform random sample of the rest.
+
+    Used to cap translation/analysis cost on large requests while keeping the sentiment
+    distribution representative. Kept comments stay in their original order.
+    """
+    if k >= len(comments):
+        return list(comments)
+    if k <= 0:
+        return []
+    by_likes = sorted(range(len(comments)), key=lambda i: comments[i].get("like_count") or 0, reverse=True)
+    n_top = min(k, int(k * top_liked_share))
+    keep = set(by_likes[:n_top])
+    keep.update(random.Random(seed).sample(by_likes[n_top:], k - n_top))
+    return [c for i, c in enumerate(comments) if i in keep]
+
+
 def analyze_comments_to_df(comments: List[Dict], method: str = "vader") -> pd.DataFrame:
     """
     Convert a list of comment dicts into a DataFrame and annotate sentiment.
@@ -158,24 +339,34 @@ def analyze_comments_to_df(comments: List[Dict], method: str = "vader") -> pd.Da
             df[col] = np.nan
 
     # Language detection and translation
-    df["language"] = df["text"].astype(str).apply(detect_language)
+    df["language"] = detect_languages(df["text"].astype(str).tolist())
 
-    def _translate_row(txt: str, lang: str) -> Tuple[str, bool]:
-        return translate_to_english(txt, lang)
-
-    trans = df.apply(lambda r: _translate_row(str(r.get("text", "")), str(r.get("language", "und"))), axis=1)
-    df["translated_text"] = trans.apply(lambda x: x[0])
-    df["translation_error"] = trans.apply(lambda x: x[1])
+    # Most comments are English; only the rest go to the (concurrent, network-bound) translator
+    df["translated_text"] = df["text"].astype(str)
+    df["translation_error"] = False
+    needs = ~df["language"].isin(["en", "und"])
+    if needs.any():
+        trans = translate_many(df.loc[needs, "translated_text"].tolist(), df.loc[needs, "language"].tolist())
+        df.loc[needs, "translated_text"] = [t for t, _ in trans]
+        df.loc[needs, "translation_error"] = [err for _, err in trans]
 
     # Analysis text (English) and wordcloud text
-    df["analysis_text"] = df["translated_text"].astype(str).apply(prepare_for_sentiment)
+    translated = df["translated_text"].astype(str).tolist()
+    df["analysis_text"] = [prepare_for_sentiment(t) for t in translated]
     # For wordclouds, use a more aggressive clean on translated (English) text so clouds are meaningful
-    df["wc_text"] = df["translated_text"].astype(str).apply(clean_text)
+    df["wc_text"] = [clean_text(t) for t in translated]
 
-    # Sentiment on English text
-    scores_labels = df["analysis_text"].apply(lambda t: analyze_sentiment_text(t, method))
-    df["sentiment_score"] = scores_labels.apply(lambda x: x[0])
-    df["sentiment"] = scores_labels.apply(lambda x: x[1])
+    # Sentiment on English text. analysis_text is already prepared, so score it directly
+    # in one pass instead of going back through analyze_sentiment_text per row.
+    texts = df["analysis_text"].tolist()
+    if method.lower() == "textblob":
+        scores = [float(TextBlob(t).sentiment.polarity) if t else 0.0 for t in texts]
+    else:
+        polar = _vader.polarity_scores
+        scores = [float(polar(t)["compound"]) if t else 0.0 for t in texts]
+    arr = np.asarray(scores, dtype=float)
+    df["sentiment_score"] = arr
+    df["sentiment"] = labels_from_compound(arr)
 
     # Parse published_at to datetime when present
     if "published_at" in df.columns:
@@ -2,17 +2,23 @@ from __future__ import annotations
 
 import base64
 import io
+import json
+import math
 import os
 import sys
-from typing import Dict, List
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Tuple
 
 import matplotlib
 matplotlib.use('Agg')  # Use non-GUI backend
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import numpy as np
 import pandas as pd
 import seaborn as sns
-from flask import Flask, Response, redirect, render_template, request, url_for, jsonify
+from flask import Flask, Response, redirect, render_template, request, stream_with_context, url_for, jsonify
+from PIL import Image, ImageDraw, ImageFont
 from wordcloud import STOPWORDS, WordCloud
 
 # Ensure the project root (one level up from this file) is on sys.path so we can import backend/*
@@ -21,36 +27,300 @@ _PROJECT_ROOT = os.path.abspath(os.path.join(_CURRENT_DIR, os.pardir))
 if _PROJECT_ROOT not in sys.path:
     sys.path.insert(0, _PROJECT_ROOT)
 
-from backend.fetch_comments import extract_video_id, fetch_comments
-from backend.sentiment_analysis import analyze_comments_to_df
+from backend.cache import LRUCache
+from backend.fetch_comments import extract_video_id, iter_comment_pages
+from backend.sentiment_analysis import analyze_comments_to_df, sample_comments
 
 app = Flask(__name__, template_folder="templates")
 
+# Analyzed DataFrames keyed by (video_id, method, max_comments), so that /download.csv
+# right after /analyze (or a repeated analysis) skips the whole pipeline.
+_df_cache: "LRUCache[pd.DataFrame]" = LRUCache(maxsize=16, ttl=600.0)
+
+# When more comments than this are fetched, only a sample of this size (most-liked
+# plus random) is analyzed, which keeps translation cost flat for large requests.
+_SAMPLE_THRESHOLD = 200
+
+_SENTIMENT_LABELS = ["Positive", "Neutral", "Negative"]
+_SENTIMENT_COLORS = ["#2ecc71", "#95a5a6", "#e74c3c"]
+
+
+# Process-wide pool of idle matplotlib figures, reused across requests instead of being created and
+# closed each time. The dev server runs every request on a fresh thread, so the pool is shared under
+# a lock rather than thread-local; a figure is checked out by one request at a time.
+# Built with Figure() rather than pyplot so they stay out of pyplot's global (non-thread-safe) registry.
+_fig_pool: Dict[str, List[Tuple[Figure, object]]] = {}
+_fig_pool_lock = threading.Lock()
+
+
+@contextmanager
+def _pooled_axes(key: str, figsize: Tuple[float, float], dpi: int) -> Iterator[Tuple[Figure, object]]:
+    """Check out an idle (figure, axes) pair for key, cleared and ready to draw on; returned to the pool on exit."""
+    with _fig_pool_lock:
+        idle = _fig_pool.setdefault(key, [])
+        entry = idle.pop() if idle else None
+    if entry is None:
+        fig = Figure(figsize=figsize, dpi=dpi)
+        entry = (fig, fig.add_subplot())
+    else:
+        entry[1].cla()
+    try:
+        yield entry
+    finally:
+        with _fig_pool_lock:
+            _fig_pool[key].append(entry)
+
 
 def _fig_to_base64(fig) -> str:
     buf = io.BytesIO()
     fig.savefig(buf, format="png", bbox_inches="tight")
     buf.seek(0)
-    b64 = base64.b64encode(buf.read()).decode("utf-8")
-    plt.close(fig)
-    return b64
+    # The figure is pooled, so it is not closed here
+    return base64.b64encode(buf.read()).decode("utf-8")
+
+
+def _img_to_base64(img: Image.Image) -> str:
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def _font(size: int):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 only ships the fixed-size bitmap font
+        return ImageFont.load_default()
+
+
+def _draw_centered(draw: ImageDraw.ImageDraw, xy, text: str, font, fill="#333333") -> None:
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    draw.text((xy[0] - (right + left) / 2, xy[1] - (bottom + top) / 2), text, font=font, fill=fill)
+
+
+# The pie and bar charts are simple enough to draw directly with Pillow, which is much
+# cheaper per request than building and rasterizing matplotlib figures.
+def _pie_chart_b64(labels: List[str], sizes: List[int], colors: List[str], size: int = 288) -> str:
+    img = Image.new("RGB", (size, size), "white")
+    draw = ImageDraw.Draw(img)
+    font = _font(12)
+    cx = cy = size / 2
+    r = size * 0.36
+    total = float(sum(sizes))
+    angle = 140.0  # counter-clockwise from 3 o'clock, like matplotlib's startangle
+    for label, value, color in zip(labels, sizes, colors):
+        if value <= 0:
+            continue
+        sweep = 360.0 * value / total
+        # Pillow measures angles clockwise, so a counter-clockwise sweep is drawn mirrored
+        draw.pieslice(
+            (cx - r, cy - r, cx + r, cy + r),
+            start=-(angle + sweep), end=-angle, fill=color, outline="white",
+        )
+        mid = math.radians(angle + sweep / 2)
+        dx, dy = math.cos(mid), -math.sin(mid)
+        _draw_centered(draw, (cx + 0.6 * r * dx, cy + 0.6 * r * dy), f"{100 * value / total:.0f}%", font)
+        _draw_centered(draw, (cx + 1.2 * r * dx, cy + 1.2 * r * dy), label, font)
+        angle += sweep
+    return _img_to_base64(img)
+
 
+def _bar_chart_b64(labels: List[str], sizes: List[int], colors: List[str], width: int = 360, height: int = 216) -> str:
+    img = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(img)
+    font = _font(12)
+    left, right, top, bottom = 48, width - 12, 30, height - 40
+    _draw_centered(draw, (width / 2, top / 2), "Sentiment Distribution", _font(14))
 
-def _gen_wordcloud_b64(text: str, stopwords: set) -> str:
+    # Y label, rotated to read bottom-to-top
+    ylabel = Image.new("RGB", (60, 16), "white")
+    _draw_centered(ImageDraw.Draw(ylabel), (30, 8), "Count", font)
+    ylabel = ylabel.rotate(90, expand=True)
+    img.paste(ylabel, (4, int((top + bottom) / 2 - ylabel.height / 2)))
+
+    draw.line((left, top, left, bottom), fill="#333333")
+    draw.line((left, bottom, right, bottom), fill="#333333")
+    peak = max(max(sizes), 1)
+    slot = (right - left) / len(labels)
+    for i, (label, value, color) in enumerate(zip(labels, sizes, colors)):
+        x0 = left + slot * (i + 0.1)
+        x1 = left + slot * (i + 0.9)
+        y0 = bottom - (bottom - top - 14) * value / peak
+        if value > 0:
+            draw.rectangle((x0, y0, x1, bottom - 1), fill=color)
+        _draw_centered(draw, ((x0 + x1) / 2, y0 - 8), str(value), font)
+        _draw_centered(draw, ((x0 + x1) / 2, bottom + 10), label, font)
+    _draw_centered(draw, ((left + right) / 2, bottom + 28), "Sentiment", font)
+    return _img_to_base64(img)
+
+
+def _word_frequencies(texts: List[str], stopwords: set) -> Counter:
+    """Count wordcloud tokens straight from the cleaned per-comment texts, skipping stopwords and numbers."""
+    return Counter(
+        w for txt in texts for w in txt.split()
+        if w not in stopwords and not w.isdigit()
+    )
+
+
+def _gen_wordcloud_b64(freqs: Dict[str, int]) -> str:
     # Optimized wordcloud settings for speed
     wc = WordCloud(
         width=400, height=200,  # Reduced size for faster generation
         background_color="white", 
-        stopwords=stopwords,
         max_words=50,  # Limit words for faster processing
         relative_scaling=0.5,
         min_font_size=10
     )
-    img = wc.generate(text)
-    fig, ax = plt.subplots(figsize=(6, 3), dpi=72)  # Smaller figure, lower DPI
-    ax.imshow(img, interpolation="nearest")  # Faster interpolation
-    ax.axis("off")
-    return _fig_to_base64(fig)
+    # Frequencies are precomputed, so WordCloud's own tokenization is skipped
+    img = wc.generate_from_frequencies(freqs)
+    with _pooled_axes("wordcloud", figsize=(6, 3), dpi=72) as (fig, ax):  # Smaller figure, lower DPI
+        ax.imshow(img, interpolation="nearest")  # Faster interpolation
+        ax.axis("off")
+        return _fig_to_base64(fig)
+
+
+def _read_options(params) -> Tuple[str, str, int]:
+    """Read (video_input, method, max_comments) from request JSON or query args, with defaults and bounds."""
+    video_input = (params.get("video_input") or "").strip()
+    method = (params.get("method") or "vader").lower()
+    if method not in {"vader", "textblob"}:
+        method = "vader"
+    try:
+        max_comments = int(params.get("max_comments", 100))  # Reduced default from 300 to 100
+    except (ValueError, TypeError):
+        max_comments = 100
+    max_comments = max(25, min(500, max_comments))  # Reduced max from 1000 to 500
+    return video_input, method, max_comments
+
+
+def _iter_analysis(video_input: str, method: str, max_comments: int) -> Iterator[pd.DataFrame]:
+    """
+    Fetch and analyze comments page by page, yielding the DataFrame accumulated so far after each page.
+
+    Analysis of one page overlaps fetching the next. A cached result is yielded once;
+    a fresh, complete result is cached once the last page has been consumed.
+
+    When max_comments exceeds _SAMPLE_THRESHOLD, all pages are fetched first (fetching is
+    cheap next to translation) and, only if more than _SAMPLE_THRESHOLD comments actually
+    came back, a sample of that size is analyzed in page-sized chunks. The sample is
+    seeded with the video ID so repeated runs pick the same comments, and
+    df.attrs["fetched"] records how many comments were fetched.
+    """
+    video_id = extract_video_id(video_input)
+    key = (video_id, method, max_comments)
+    if video_id:
+        cached = _df_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    fetched = None
+    if max_comments <= _SAMPLE_THRESHOLD:
+        batches: Iterable[List[Dict]] = iter_comment_pages(video_input, max_comments=max_comments)
+    else:
+        comments = [c for page in iter_comment_pages(video_input, max_comments=max_comments) for c in page]
+        fetched = len(comments)
+        # Keep any YouTube API error marker (comment_id is None) out of the sample
+        markers = [c for c in comments if c.get("comment_id") is None]
+        comments = [c for c in comments if c.get("comment_id") is not None]
+        if len(comments) > _SAMPLE_THRESHOLD:
+            comments = sample_comments(comments, _SAMPLE_THRESHOLD, seed=video_id)
+        comments += markers
+        batches = (comments[i:i + 100] for i in range(0, len(comments), 100))
+
+    frames: List[pd.DataFrame] = []
+    df = None
+    for batch in batches:
+        frames.append(analyze_comments_to_df(batch, method=method))
+        # Pages arrive newest first and each frame is already sorted, so concatenation keeps the order
+        df = pd.concat(frames, ignore_index=True)
+        if fetched is not None:
+            df.attrs["fetched"] = fetched
+        yield df
+    if df is None:
+        yield analyze_comments_to_df([], method=method)
+        return
+
+    # Don't keep results that end with a YouTube API error marker (comment_id is None)
+    if df["comment_id"].notna().all():
+        _df_cache.put(key, df)
+
+
+def _analyze_video(video_input: str, method: str, max_comments: int) -> pd.DataFrame:
+    """Fetch and analyze comments page by page, so analysis of one page overlaps fetching the next."""
+    df = None
+    for df in _iter_analysis(video_input, method, max_comments):
+        pass
+    return df
+
+
+def _sentiment_stats(sentiments: np.ndarray) -> Dict[str, int]:
+    sizes = [int((sentiments == l).sum()) for l in _SENTIMENT_LABELS]
+    return {
+        "total": int(sentiments.size),
+        "positive": sizes[0],
+        "neutral": sizes[1],
+        "negative": sizes[2],
+    }
+
+
+def _build_result(df: pd.DataFrame, video_id: str) -> Dict:
+    """Build the JSON payload for an analyzed video: stats, charts and table rows."""
+    # Calculate statistics
+    sentiments = df["sentiment"].to_numpy()
+    stats = _sentiment_stats(sentiments)
+    sizes = [stats["positive"], stats["neutral"], stats["negative"]]
+    
+    print(f"[DEBUG] Stats: {stats}")
+    
+    # Generate charts
+    charts = {}
+    
+    # Pie and bar charts, drawn directly with Pillow
+    charts["pie"] = _pie_chart_b64(_SENTIMENT_LABELS, sizes, _SENTIMENT_COLORS)
+    charts["bar"] = _bar_chart_b64(_SENTIMENT_LABELS, sizes, _SENTIMENT_COLORS)
+    
+    # WordClouds - only generate if sufficient data
+    stopwords = set(STOPWORDS)
+    stopwords.update({"https", "http", "www", "youtube", "video"})
+    wc_texts = df["wc_text"].to_numpy()
+    pos_freqs = _word_frequencies(wc_texts[sentiments == "Positive"], stopwords)
+    neg_freqs = _word_frequencies(wc_texts[sentiments == "Negative"], stopwords)
+    
+    # Only generate wordclouds if enough text (minimum 20 words for better performance)
+    if sum(pos_freqs.values()) >= 20:
+        charts["wc_pos"] = _gen_wordcloud_b64(pos_freqs)
+    if sum(neg_freqs.values()) >= 20:
+        charts["wc_neg"] = _gen_wordcloud_b64(neg_freqs)
+    
+    # Table data (limit 100 rows for faster processing)
+    display_cols = ["published_at", "author", "language", "like_count", "text", "translated_text", "sentiment", "sentiment_score"]
+    # reindex copies (and adds any missing column) so the cached DataFrame is left untouched
+    table = df.head(100).reindex(columns=display_cols)
+    
+    # Make every column JSON-friendly with column-wise ops: dates as strings, NaN -> 0 / ""
+    table["published_at"] = (
+        pd.to_datetime(table["published_at"], errors="coerce").dt.strftime("%Y-%m-%d %H:%M:%S").fillna("")
+    )
+    table["like_count"] = pd.to_numeric(table["like_count"], errors="coerce").fillna(0).astype(int)
+    table_records = table.fillna("").to_dict(orient="records")
+    
+    result = {
+        "success": True,
+        "video_id": video_id,
+        "stats": stats,
+        "charts": charts,
+        "table_records": table_records
+    }
+    # Tell the UI when only a sample of the fetched comments was analyzed
+    fetched = df.attrs.get("fetched", stats["total"])
+    if fetched > stats["total"]:
+        result["sampled_from"] = int(fetched)
+    return result
+
+
+def _sse(event: str, payload: Dict) -> str:
+    """Format one Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
 
 
 @app.route("/", methods=["GET"]) 
@@ -68,15 +338,7 @@ def analyze():
         data = request.get_json()
         print(f"[DEBUG] Received data: {data}")  # Debug log
         
-        video_input = (data.get("video_input") or "").strip()
-        method = (data.get("method") or "vader").lower()
-        if method not in {"vader", "textblob"}:
-            method = "vader"
-        try:
-            max_comments = int(data.get("max_comments", 100))  # Reduced default from 300 to 100
-        except (ValueError, TypeError):
-            max_comments = 100
-        max_comments = max(25, min(500, max_comments))  # Reduced max from 1000 to 500
+        video_input, method, max_comments = _read_options(data)
         
         print(f"[DEBUG] Processing: video={video_input}, method={method}, max_comments={max_comments}")
         
@@ -93,91 +355,16 @@ def analyze():
         print(f"[DEBUG] Extracted video ID: {video_id}")
         
         # Fetch comments and analyze sentiment
-        raw_comments = fetch_comments(video_input, max_comments=max_comments)
-        print(f"[DEBUG] Fetched {len(raw_comments)} raw comments")
-        
-        df = analyze_comments_to_df(raw_comments, method=method)
+        df = _analyze_video(video_input, method, max_comments)
         print(f"[DEBUG] Analyzed comments, DataFrame shape: {df.shape}")
         
         if df.empty:
             print("[DEBUG] DataFrame is empty - no comments found")
             return jsonify({"error": "No comments found or failed to fetch comments."}), 400
         
-        # Calculate statistics
-        counts = (
-            df["sentiment"].value_counts().reindex(["Positive", "Neutral", "Negative"]).fillna(0).astype(int)
-        )
-        stats = {
-            "total": int(df.shape[0]),
-            "positive": int(counts.get("Positive", 0)),
-            "neutral": int(counts.get("Neutral", 0)),
-            "negative": int(counts.get("Negative", 0)),
-        }
-        
-        print(f"[DEBUG] Stats: {stats}")
-        
-        # Generate charts
-        charts = {}
+        result = _build_result(df, video_id)
         
-        # Pie chart - optimized size and settings
-        fig, ax = plt.subplots(figsize=(4, 4), dpi=72)  # Reduced size and DPI for speed
-        labels = ["Positive", "Neutral", "Negative"]
-        sizes = [counts.get(l, 0) for l in labels]
-        colors = ["#2ecc71", "#95a5a6", "#e74c3c"]
-        ax.pie(sizes, labels=labels, autopct="%1.0f%%", startangle=140, colors=colors)  # Reduced decimal precision
-        ax.axis("equal")
-        charts["pie"] = _fig_to_base64(fig)
-        
-        # Bar chart - optimized size
-        fig, ax = plt.subplots(figsize=(5, 3), dpi=72)  # Reduced size and DPI for speed
-        ax.bar(labels, sizes, color=["#2ecc71", "#95a5a6", "#e74c3c"])  # Use simple bar instead of seaborn
-        ax.set_xlabel("Sentiment")
-        ax.set_ylabel("Count")
-        ax.set_title("Sentiment Distribution")
-        charts["bar"] = _fig_to_base64(fig)
-        
-        # WordClouds - only generate if sufficient data
-        stopwords = set(STOPWORDS)
-        stopwords.update({"https", "http", "www", "youtube", "video"})
-        pos_text = " ".join(df.loc[df["sentiment"] == "Positive", "wc_text"].tolist())
-        neg_text = " ".join(df.loc[df["sentiment"] == "Negative", "wc_text"].tolist())
-        
-        # Only generate wordclouds if enough text (minimum 20 words for better performance)
-        if pos_text.strip() and len(pos_text.split()) >= 20:
-            charts["wc_pos"] = _gen_wordcloud_b64(pos_text, stopwords)
-        if neg_text.strip() and len(neg_text.split()) >= 20:
-            charts["wc_neg"] = _gen_wordcloud_b64(neg_text, stopwords)
-        
-        # Table data (limit 100 rows for faster processing)
-        display_cols = ["published_at", "author", "language", "like_count", "text", "translated_text", "sentiment", "sentiment_score"]
-        for c in display_cols:
-            if c not in df.columns:
-                df[c] = np.nan
-        table_records = (
-            df[display_cols].fillna("").head(100).to_dict(orient="records")
-        )
-        
-        # Convert datetime objects to strings and handle NaN values for JSON serialization
-        for record in table_records:
-            if pd.notna(record.get("published_at")):
-                record["published_at"] = str(record["published_at"])
-            # Replace any NaN values with empty strings or appropriate defaults
-            for key, value in record.items():
-                if pd.isna(value) or (isinstance(value, float) and np.isnan(value)):
-                    if key == "like_count":
-                        record[key] = 0
-                    else:
-                        record[key] = ""
-        
-        result = {
-            "success": True,
-            "video_id": video_id,
-            "stats": stats,
-            "charts": charts,
-            "table_records": table_records
-        }
-        
-        print(f"[DEBUG] Returning successful result with {len(table_records)} table records")
+        print(f"[DEBUG] Returning successful result with {len(result['table_records'])} table records")
         print(f"[DEBUG] Result keys: {list(result.keys())}")
         print(f"[DEBUG] Charts keys: {list(result['charts'].keys())}")
         return jsonify(result)
@@ -189,24 +376,62 @@ def analyze():
         return jsonify({"error": str(e)}), 500
 
 
+@app.route("/analyze/stream", methods=["GET"]) 
+def analyze_stream():
+    """
+    Same analysis as /analyze, streamed as Server-Sent Events.
+
+    Emits a "progress" event with running stats after each page of comments is analyzed,
+    then a single "result" event carrying the /analyze payload, or an "error" event.
+    """
+    video_input, method, max_comments = _read_options(request.args)
+    video_id = extract_video_id(video_input) if video_input else None
+
+    def _events() -> Iterator[str]:
+        if not video_input:
+            yield _sse("error", {"error": "No video URL provided"})
+            return
+        if not video_id:
+            yield _sse("error", {"error": "Could not extract a valid YouTube video ID from the provided input."})
+            return
+        try:
+            df = None
+            for df in _iter_analysis(video_input, method, max_comments):
+                yield _sse("progress", {"stats": _sentiment_stats(df["sentiment"].to_numpy())})
+            if df is None or df.empty:
+                yield _sse("error", {"error": "No comments found or failed to fetch comments."})
+                return
+            yield _sse("result", _build_result(df, video_id))
+        except Exception as e:
+            print(f"[DEBUG] Error in analyze stream: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            yield _sse("error", {"error": str(e)})
+
+    return Response(
+        stream_with_context(_events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.route("/download.csv", methods=["GET"]) 
 def download_csv():
-    video_input = (request.args.get("video_input") or "").strip()
-    method = (request.args.get("method") or "vader").lower()
-    try:
-        max_comments = int(request.args.get("max_comments", 300))
-    except ValueError:
-        max_comments = 300
-    max_comments = max(50, min(1000, max_comments))
+    # Same options and bounds as /analyze so the download reuses the cached analysis
+    video_input, method, max_comments = _read_options(request.args)
 
-    raw_comments = fetch_comments(video_input, max_comments=max_comments)
-    df = analyze_comments_to_df(raw_comments, method=method)
+    df = _analyze_video(video_input, method, max_comments)
     csv_bytes = df.to_csv(index=False).encode("utf-8")
     vid = extract_video_id(video_input) or "video"
+    filename = f"sentiment_{vid}.csv"
+    # Large requests are analyzed on a sample; say so in the file name
+    fetched = df.attrs.get("fetched", len(df))
+    if fetched > len(df):
+        filename = f"sentiment_{vid}_sample_{len(df)}_of_{fetched}.csv"
     return Response(
         csv_bytes,
         headers={
-            "Content-Disposition": f"attachment; filename=sentiment_{vid}.csv",
+            "Content-Disposition": f"attachment; filename={filename}",
             "Content-Type": "text/csv",
         },
     )